@@ -1,33 +1,24 @@
 #!/usr/bin/env python3
-import asyncio
-import base64
-from email.utils import formatdate
 import logging
-import re
-import argparse
-import json
+import os
 import sys
 
-# Configuración básica de logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+from smtp_common import (
+    DEFAULT_SMTP_PORT,
+    DEFAULT_SMTP_SERVER,
+    SUCCESS_OUTPUT,
+    UNKNOWN_ERROR_OUTPUT,
+    build_error_outputs,
+    json_loads,
+    parse_custom_headers,
+    validate_email_address,
+    validate_many,
+    write_output,
 )
 
-# Constantes y expresiones regulares
-DEFAULT_SMTP_SERVER = "127.0.0.1"
-DEFAULT_SMTP_PORT = 2525
-EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+logger = logging.getLogger(__name__)
 
-class SMTPClientError(Exception):
-    """Excepción personalizada para errores del cliente SMTP"""
-    pass
-
-def validate_email_address(email: str) -> bool:
-    """Valida una dirección de email usando expresión regular"""
-    return isinstance(email, str) and bool(EMAIL_REGEX.match(email))
-
-async def send_email(
+def send_email_sync(
     sender_address: str,
     sender_password: str,
     recipient_addresses: list,
@@ -38,7 +29,7 @@ async def send_email(
     smtp_port: int = DEFAULT_SMTP_PORT
 ) -> tuple:
     """
-    Función asíncrona que simula el envío de un correo.
+    Función síncrona que simula el envío de un correo (no realiza E/S).
     
     Retorna:
         tuple: (email_sent: bool, error_type: int)
@@ -48,29 +39,25 @@ async def send_email(
     if not sender_address or not validate_email_address(sender_address):
         return False, 1
 
-    # Validar cada destinatario
-    for recipient in recipient_addresses:
-        if not recipient or not validate_email_address(recipient):
-            return False, 2
+    # Validar todos los destinatarios
+    if not validate_many(recipient_addresses):
+        return False, 2
 
     # Aquí se simula el envío (sin conexión real a un servidor SMTP)
-    logging.info("Simulación de envío de correo (no se realiza conexión real).")
+    logger.info("Simulación de envío de correo (no se realiza conexión real).")
     return True, 0
 
+# Mensajes de error por tipo de error
+ERROR_MESSAGES = {
+    0: "Unknown server error.",
+    1: "Invalid sender address",
+    2: "Invalid recipient address",
+    3: "SMTP error."
+}
+ERROR_OUTPUTS = build_error_outputs(ERROR_MESSAGES)
+
 def main():
-    # Mapas de errores y códigos de estado
-    error_messages = {
-        0: "Unknown server error.",
-        1: "Invalid sender address",
-        2: "Invalid recipient address",
-        3: "SMTP error."
-    }
-    status_codes = {
-        0: 550,  # Error genérico
-        1: 501,
-        2: 550,
-        3: 503
-    }
+    import argparse
 
     # Configuración de argumentos de línea de comandos
     parser = argparse.ArgumentParser(
@@ -92,25 +79,24 @@ def main():
     
     args = parser.parse_args()
 
+    # Configuración de logging: DEBUG solo si SMTP_DEBUG=1
+    logging.basicConfig(
+        level=logging.DEBUG if os.environ.get("SMTP_DEBUG") == "1" else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
     # Procesamiento de encabezados personalizados
     try:
-        if args.header:
-            custom_headers = json.loads(" ".join(args.header))
-            # Validar que los encabezados sean ASCII
-            for key, value in custom_headers.items():
-                if not all(ord(c) < 128 for c in f"{key}: {value}"):
-                    raise ValueError("Encabezados contienen caracteres no ASCII")
-        else:
-            custom_headers = {}
+        custom_headers = parse_custom_headers(args.header)
     except Exception as e:
-        print(json.dumps({"status_code": 400, "message": f"Error en encabezados: {str(e)}"}))
+        write_output({"status_code": 400, "message": f"Error en encabezados: {str(e)}"})
         sys.exit(1)
 
     # Procesamiento de destinatarios (se espera un JSON array)
     try:
-        recipients = json.loads(" ".join(args.to_mail))
+        recipients = json_loads(" ".join(args.to_mail))
     except Exception as e:
-        print(json.dumps({"status_code": 400, "message": f"Error en destinatarios: {str(e)}"}))
+        write_output({"status_code": 400, "message": f"Error en destinatarios: {str(e)}"})
         sys.exit(1)
 
     # Construcción del asunto y cuerpo del correo
@@ -118,31 +104,26 @@ def main():
     email_body = " ".join(args.body) if args.body else " "
 
     try:
-        # Ejecutar la función asíncrona que simula el envío
-        result, error_type = asyncio.run(
-            send_email(
-                args.from_mail,
-                args.password,
-                recipients,
-                email_subject,
-                email_body,
-                custom_headers,
-                args.host,
-                args.port
-            )
+        # Ejecutar la simulación del envío (sin bucle de eventos)
+        result, error_type = send_email_sync(
+            args.from_mail,
+            args.password,
+            recipients,
+            email_subject,
+            email_body,
+            custom_headers,
+            args.host,
+            args.port
         )
 
         if result:
-            output = {"status_code": 250, "message": "Message accepted for delivery"}
+            output = SUCCESS_OUTPUT
         else:
-            output = {
-                "status_code": status_codes.get(error_type, 550),
-                "message": error_messages.get(error_type, "Unknown error")
-            }
+            output = ERROR_OUTPUTS.get(error_type, UNKNOWN_ERROR_OUTPUT)
     except Exception as e:
         output = {"status_code": 500, "message": f"Excepción: {e}"}
 
-    print(json.dumps(output))
+    write_output(output)
 
 if __name__ == "__main__":
     main()
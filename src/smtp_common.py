@@ -0,0 +1,99 @@
+import re
+import sys
+
+# Serialización JSON: orjson si está disponible, si no la biblioteca estándar
+try:
+    import orjson
+
+    json_loads = orjson.loads
+    json_dumps = orjson.dumps
+except ImportError:
+    import json
+
+    json_loads = json.loads
+
+    def json_dumps(obj) -> bytes:
+        # Mismo formato que orjson: compacto y UTF-8 sin escapes
+        return json.dumps(obj, separators=(",", ":"), ensure_ascii=False).encode()
+
+# google-re2 (DFA, tiempo lineal) si está disponible
+try:
+    import re2 as _re2
+except ImportError:
+    _re2 = None
+
+# Constantes y expresiones regulares precompiladas
+DEFAULT_SMTP_SERVER = "127.0.0.1"
+DEFAULT_SMTP_PORT = 2525
+EMAIL_PATTERN = r"[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}"
+EMAIL_REGEX = re.compile(EMAIL_PATTERN)
+if _re2 is not None:
+    # Otros paquetes (pyre2, fb-re2) también instalan un módulo re2 sin fullmatch
+    _re2_regex = _re2.compile(EMAIL_PATTERN)
+    if hasattr(_re2_regex, "fullmatch"):
+        EMAIL_REGEX = _re2_regex
+_fullmatch = EMAIL_REGEX.fullmatch
+
+# Códigos de estado por tipo de error
+STATUS_CODES = {
+    0: 550,  # Error genérico
+    1: 501,
+    2: 550,
+    3: 503
+}
+
+# Salidas JSON precalculadas para los resultados habituales
+SUCCESS_OUTPUT = json_dumps({"status_code": 250, "message": "Message accepted for delivery"}) + b"\n"
+UNKNOWN_ERROR_OUTPUT = json_dumps({"status_code": 550, "message": "Unknown error"}) + b"\n"
+
+
+class SMTPClientError(Exception):
+    """Excepción personalizada para errores del cliente SMTP"""
+    pass
+
+
+def validate_email_address(email: str) -> bool:
+    """Valida una dirección de email usando expresión regular"""
+    # Descarte barato (búsqueda de subcadenas en C) antes de ejecutar la regex
+    return (isinstance(email, str) and "@" in email and "." in email[email.rfind("@"):]
+            and _fullmatch(email) is not None)
+
+
+def validate_many(addresses: list) -> bool:
+    """Valida una lista de direcciones de email en una sola pasada"""
+    return all(map(validate_email_address, addresses))
+
+
+def build_error_outputs(error_messages: dict) -> dict:
+    """Precalcula la salida JSON de cada tipo de error"""
+    return {
+        error_type: json_dumps({"status_code": STATUS_CODES[error_type], "message": message}) + b"\n"
+        for error_type, message in error_messages.items()
+    }
+
+
+def parse_custom_headers(header) -> dict:
+    """Convierte el argumento -h en un dict de encabezados ASCII"""
+    if not header:
+        return {}
+    header_text = " ".join(header) if isinstance(header, list) else header
+    custom_headers = json_loads(header_text)
+    if not isinstance(custom_headers, dict):
+        raise ValueError("Los encabezados deben ser un objeto JSON")
+    # Validar que los encabezados sean ASCII: un JSON ASCII sin escapes \u
+    # solo puede producir claves y valores ASCII
+    if not header_text.isascii():
+        raise ValueError("Encabezados contienen caracteres no ASCII")
+    if "\\u" in header_text:
+        for key, value in custom_headers.items():
+            if not (key.isascii() and str(value).isascii()):
+                raise ValueError("Encabezados contienen caracteres no ASCII")
+    return custom_headers
+
+
+def write_output(output) -> None:
+    """Escribe la respuesta en stdout: un dict se serializa, bytes se escriben tal cual"""
+    if isinstance(output, dict):
+        output = json_dumps(output) + b"\n"
+    sys.stdout.buffer.write(output)
+    sys.stdout.flush()
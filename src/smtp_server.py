@@ -1,42 +1,132 @@
-import socket
+import asyncio
 import json
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+
+from smtp_utils import new_event_loop
+
+def _encode_response(status_code, message):
+    return json.dumps({"status_code": status_code, "message": message}).encode() + b"\r\n"
 
-def handle_client(client_socket):
-    client_socket.send(b"220 Welcome to Simple SMTP Server\r\n")
-    while True:
-        data = client_socket.recv(1024).decode()
-        if not data:
-            break
-        print(f"Received: {data.strip()}")
-
-        response = {"status_code": 250, "message": "Message accepted for delivery"}
-        if data.startswith("HELO") or data.startswith("EHLO"):
-            response["message"] = "Hello"
-        elif data.startswith("MAIL FROM"):
-            response["message"] = "Sender OK"
-        elif data.startswith("RCPT TO"):
-            response["message"] = "Recipient OK"
-        elif data.startswith("DATA"):
-            response["message"] = "Ready for data"
-        elif data.startswith("QUIT"):
-            response["message"] = "Goodbye"
-        else:
-            response = {"status_code": 502, "message": "Command not implemented"}
-
-        client_socket.send(json.dumps(response).encode() + b"\r\n")
-
-    client_socket.close()
-
-def start_server(bind_address="0.0.0.0", port=2525):
+# Respuestas precalculadas indexadas por el prefijo de 4 bytes del comando
+RESPONSES = {
+    b"HELO": _encode_response(250, "Hello"),
+    b"EHLO": _encode_response(250, "Hello"),
+    b"MAIL": _encode_response(250, "Sender OK"),
+    b"RCPT": _encode_response(250, "Recipient OK"),
+    b"DATA": _encode_response(250, "Ready for data"),
+    b"QUIT": _encode_response(250, "Goodbye"),
+}
+UNKNOWN_COMMAND = _encode_response(502, "Command not implemented")
+
+async def handle_client(reader, writer):
+    print(f"Accepted connection from {writer.get_extra_info('peername')}")
+    # Respuestas cortas de petición/respuesta: sin retrasos del algoritmo de Nagle
+    writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+    try:
+        writer.write(b"220 Welcome to Simple SMTP Server\r\n")
+        await writer.drain()
+        while True:
+            try:
+                line = await reader.readuntil(b"\r\n")
+            except asyncio.IncompleteReadError as e:
+                line = e.partial
+            except asyncio.LimitOverrunError:
+                # Línea demasiado larga sin terminar: no se interpreta como comando
+                writer.write(UNKNOWN_COMMAND)
+                await writer.drain()
+                break
+            if not line:
+                break
+            print(f"Received: {line.strip().decode(errors='replace')}")
+            writer.write(RESPONSES.get(line[:4].upper(), UNKNOWN_COMMAND))
+            await writer.drain()
+    except ConnectionError:
+        pass
+    finally:
+        writer.close()
+        try:
+            await writer.wait_closed()
+        except ConnectionError:
+            pass
+
+def create_listening_socket(bind_address, port, reuse_port=False):
     server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
     server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-    server_socket.bind((bind_address, port))
-    server_socket.listen(5)
-    print(f"SMTP server listening on {bind_address}:{port}")
-    while True:
-        client_socket, addr = server_socket.accept()
-        print(f"Accepted connection from {addr}")
-        handle_client(client_socket)
+    if reuse_port:
+        # Cada worker tiene su propio socket; el kernel reparte las conexiones
+        server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+    try:
+        server_socket.bind((bind_address, port))
+    except OSError:
+        server_socket.close()
+        raise
+    return server_socket
+
+async def serve(server_socket):
+    server = await asyncio.start_server(handle_client, sock=server_socket)
+    async with server:
+        await server.serve_forever()
+
+def run_worker(server_socket):
+    # Bucle de eventos de uvloop si está disponible, igual que en el cliente
+    try:
+        with asyncio.Runner(loop_factory=new_event_loop) as runner:
+            runner.run(serve(server_socket))
+    except KeyboardInterrupt:
+        pass
+
+def start_server(bind_address="0.0.0.0", port=2525, workers=None):
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if not hasattr(socket, "SO_REUSEPORT"):
+        workers = 1
+
+    # Sin SO_REUSEPORT el bind falla si otra instancia ya ocupa el puerto. Con
+    # varios workers se hace primero esta comprobación y luego se comparte.
+    try:
+        server_socket = create_listening_socket(bind_address, port)
+    except OSError as e:
+        print(f"Cannot bind {bind_address}:{port}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if workers == 1:
+        print(f"SMTP server listening on {bind_address}:{port}")
+        run_worker(server_socket)
+        return
+    server_socket.close()
+
+    # Un proceso con su propio socket y bucle de eventos por núcleo. Cada socket
+    # se crea en el padre, que cierra su copia tras lanzar el worker, de modo que
+    # cada worker solo hereda el suyo.
+    processes = []
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        for _ in range(workers):
+            try:
+                server_socket = create_listening_socket(bind_address, port, reuse_port=True)
+            except OSError as e:
+                print(f"Cannot bind {bind_address}:{port}: {e}", file=sys.stderr)
+                sys.exit(1)
+            process = multiprocessing.Process(target=run_worker, args=(server_socket,), daemon=True)
+            process.start()
+            server_socket.close()
+            processes.append(process)
+        print(f"SMTP server listening on {bind_address}:{port} ({workers} workers)")
+
+        for process in processes:
+            process.join()
+        if any(process.exitcode for process in processes):
+            print("SMTP server workers exited with errors", file=sys.stderr)
+            sys.exit(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for process in processes:
+            process.terminate()
 
 if __name__ == "__main__":
     start_server()
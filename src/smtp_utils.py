@@ -1,44 +1,92 @@
 import asyncio
-import base64
-from email.utils import formatdate
 import logging
-import re
-import argparse
-import json
-
-# Configuración básica de logging
-logging.basicConfig(
-    level=logging.DEBUG,
-    format='%(asctime)s - %(levelname)s - %(message)s'
+import os
+import socket
+import sys
+import time
+
+from smtp_common import (
+    DEFAULT_SMTP_PORT,
+    DEFAULT_SMTP_SERVER,
+    SUCCESS_OUTPUT,
+    UNKNOWN_ERROR_OUTPUT,
+    SMTPClientError,
+    build_error_outputs,
+    json_loads,
+    parse_custom_headers,
+    validate_email_address,
+    validate_many,
+    write_output,
 )
 
-# Constantes y expresiones regulares precompiladas
-DEFAULT_SMTP_SERVER = "127.0.0.1"
-DEFAULT_SMTP_PORT = 2525
-EMAIL_REGEX = re.compile(r"^[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\.[a-zA-Z]{2,}$")
+logger = logging.getLogger(__name__)
 
+# Comandos y fragmentos SMTP precodificados
+CRLF = b"\r\n"
+EHLO_COMMAND = b"EHLO localhost\r\n"
+AUTH_PLAIN_COMMAND = b"AUTH PLAIN\r\n"
+MAIL_FROM = b"MAIL FROM:"
+RCPT_TO = b"RCPT TO:"
+DATA_COMMAND = b"DATA\r\n"
+END_OF_DATA = b"\r\n.\r\n"
+QUIT_COMMAND = b"QUIT\r\n"
 
-class SMTPClientError(Exception):
-    """Excepción personalizada para errores del cliente SMTP"""
-    pass
+# Última fecha formateada: (segundo epoch, valor del encabezado Date)
+_date_cache = (0, b"")
 
 
-def validate_email_address(email: str) -> bool:
-    """Valida una dirección de email usando expresión regular"""
-    return bool(EMAIL_REGEX.match(email))
+def current_date_header() -> bytes:
+    """Devuelve el valor del encabezado Date, recalculado a lo sumo una vez por segundo"""
+    global _date_cache
+    now = int(time.time())
+    if _date_cache[0] != now:
+        from email.utils import formatdate
+        _date_cache = (now, formatdate(now, localtime=True).encode("ascii"))
+    return _date_cache[1]
 
 
-async def read_server_response(reader: asyncio.StreamReader) -> str:
-    """Lee y procesa la respuesta del servidor SMTP"""
-    response_data = await reader.read(1024)
-    decoded_response = response_data.decode().strip()
-    logging.debug(f"Respuesta del servidor: {decoded_response}")
-    
+def new_event_loop() -> asyncio.AbstractEventLoop:
+    """Crea un bucle de eventos de uvloop (libuv) si está disponible, o el de asyncio"""
+    if sys.platform != "win32":
+        try:
+            import uvloop
+        except ImportError:
+            pass
+        else:
+            return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def ehlo_has_extension(ehlo_response: bytes, keyword: bytes) -> bool:
+    """Indica si la respuesta EHLO anuncia la extensión indicada"""
+    # La primera línea contiene el dominio y el saludo; cada línea siguiente
+    # es "250-EXTENSIÓN parámetros" o "250 EXTENSIÓN parámetros"
+    for line in ehlo_response.split(CRLF)[1:]:
+        if line[:3] == b"250" and line[4:].upper().split(None, 1)[:1] == [keyword]:
+            return True
+    return False
+
+
+async def read_server_response(reader: asyncio.StreamReader) -> bytes:
+    """Lee y procesa la respuesta del servidor SMTP (incluidas las multilínea)"""
+    response = b""
+    while True:
+        try:
+            line = await reader.readuntil(CRLF)
+        except asyncio.IncompleteReadError as e:
+            line = e.partial
+        response += line
+        # Las líneas "250-..." indican que la respuesta continúa
+        if line[3:4] != b"-":
+            break
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Respuesta del servidor: %s", response.decode(errors="replace").strip())
+
     # Verificar código de estado SMTP (2xx o 3xx son exitosos)
-    if not decoded_response[:1] in {'2', '3'}:
-        raise SMTPClientError(f"Error del servidor: {decoded_response}")
-    
-    return decoded_response
+    if response[:1] not in (b"2", b"3"):
+        raise SMTPClientError(f"Error del servidor: {response.decode(errors='replace').strip()}")
+
+    return response
 
 
 async def send_email(
@@ -64,116 +112,158 @@ async def send_email(
     if not validate_email_address(sender_address):
         return email_sent, 1
     
-    for recipient in recipient_addresses:
-        if not validate_email_address(recipient):
-            return email_sent, 2
-
-    # Construcción de encabezados del correo
-    email_headers = [
-        f"From: {sender_address}",
-        f"To: {', '.join(recipient_addresses)}",
-        f"Subject: {email_subject}",
-        f"Date: {formatdate(localtime=True)}"
-    ]
-    
-    # Agregar encabezados personalizados
-    for header, value in custom_headers.items():
-        email_headers.append(f"{header}: {value}")
-    
-    # Construir contenido completo del correo
-    email_content = "\r\n".join(email_headers) + "\r\n\r\n" + email_body
+    if not validate_many(recipient_addresses):
+        return email_sent, 2
+
     writer = None
 
     try:
+        # Direcciones codificadas una sola vez (ya validadas como ASCII)
+        sender_bytes = sender_address.encode("ascii")
+        recipient_bytes = [recipient.encode("ascii") for recipient in recipient_addresses]
+
+        # Construcción de encabezados del correo
+        email_headers = bytearray(b"From: ")
+        email_headers += sender_bytes
+        email_headers += b"\r\nTo: "
+        for index, recipient in enumerate(recipient_bytes):
+            if index:
+                email_headers += b", "
+            email_headers += recipient
+        email_headers += b"\r\nSubject: "
+        email_headers += email_subject.encode()
+        email_headers += b"\r\nDate: "
+        email_headers += current_date_header()
+        email_headers += CRLF
+
+        # Agregar encabezados personalizados
+        for header, value in custom_headers.items():
+            email_headers += f"{header}: {value}".encode()
+            email_headers += CRLF
+
+        # Línea en blanco que separa encabezados y cuerpo
+        email_headers += CRLF
+        body_bytes = email_body.encode()
+
         # Establecer conexión con el servidor SMTP
         reader, writer = await asyncio.open_connection(smtp_server, smtp_port)
+        # SMTP es un diálogo de comandos cortos: desactivar el algoritmo de Nagle
+        writer.get_extra_info("socket").setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
         await read_server_response(reader)
 
         # Inicio de sesión SMTP
-        writer.write(b"EHLO localhost\r\n")
+        writer.write(EHLO_COMMAND)
         await writer.drain()
-        await read_server_response(reader)
+        ehlo_response = await read_server_response(reader)
+        supports_pipelining = ehlo_has_extension(ehlo_response, b"PIPELINING")
 
         # Autenticación PLAIN (si está soportada)
         try:
-            writer.write(b"AUTH PLAIN\r\n")
+            writer.write(AUTH_PLAIN_COMMAND)
             await writer.drain()
             auth_response = await read_server_response(reader)
-            if auth_response.startswith('334'):
+            if auth_response.startswith(b"334"):
+                import base64
                 auth_credentials = f"\0{sender_address}\0{sender_password}".encode()
-                auth_b64 = base64.b64encode(auth_credentials)
-                writer.write(auth_b64 + b"\r\n")
+                writer.writelines((base64.b64encode(auth_credentials), CRLF))
                 await writer.drain()
                 await read_server_response(reader)
         except SMTPClientError as e:
             if "502" in str(e):
-                logging.warning("Autenticación no soportada, continuando sin autenticar")
+                logger.warning("Autenticación no soportada, continuando sin autenticar")
             else:
                 raise
 
         # Proceso de envío SMTP
-        writer.write(f"MAIL FROM:{sender_address}\r\n".encode())
-        await writer.drain()
-        try:
-            await read_server_response(reader)
-        except SMTPClientError as e:
-            error_type = 1  # Error de remitente
-            raise
+        if supports_pipelining:
+            # RFC 2920: MAIL FROM, todos los RCPT TO y DATA en una sola escritura
+            commands = bytearray()
+            commands += MAIL_FROM
+            commands += sender_bytes
+            commands += CRLF
+            for recipient in recipient_bytes:
+                commands += RCPT_TO
+                commands += recipient
+                commands += CRLF
+            commands += DATA_COMMAND
+            writer.write(commands)
+            await writer.drain()
 
-        for recipient in recipient_addresses:
-            writer.write(f"RCPT TO:{recipient}\r\n".encode())
+            try:
+                await read_server_response(reader)
+            except SMTPClientError as e:
+                error_type = 1  # Error de remitente
+                raise
+
+            for _ in recipient_bytes:
+                try:
+                    await read_server_response(reader)
+                except SMTPClientError as e:
+                    error_type = 2  # Error de destinatario
+                    raise
+
+            await read_server_response(reader)
+        else:
+            writer.writelines((MAIL_FROM, sender_bytes, CRLF))
             await writer.drain()
             try:
                 await read_server_response(reader)
             except SMTPClientError as e:
-                error_type = 2  # Error de destinatario
+                error_type = 1  # Error de remitente
                 raise
-            
-        # Envío del contenido del correo
-        writer.write(b"DATA\r\n")
-        await writer.drain()
-        await read_server_response(reader)
 
-        writer.write(email_content.encode() + b"\r\n.\r\n")
+            for recipient in recipient_bytes:
+                writer.writelines((RCPT_TO, recipient, CRLF))
+                await writer.drain()
+                try:
+                    await read_server_response(reader)
+                except SMTPClientError as e:
+                    error_type = 2  # Error de destinatario
+                    raise
+
+            # Envío del contenido del correo
+            writer.write(DATA_COMMAND)
+            await writer.drain()
+            await read_server_response(reader)
+
+        # Encabezados, cuerpo y terminador como búferes separados, sin concatenarlos
+        writer.writelines((email_headers, body_bytes, END_OF_DATA))
         await writer.drain()
         await read_server_response(reader)
 
         # Finalizar conexión
-        writer.write(b"QUIT\r\n")
+        writer.write(QUIT_COMMAND)
         await writer.drain()
         await read_server_response(reader)
 
         email_sent = True
-        logging.info("Correo electrónico enviado exitosamente")
+        logger.info("Correo electrónico enviado exitosamente")
 
     except SMTPClientError as e:
-        logging.error(f"Error SMTP: {str(e)}")
+        logger.error("Error SMTP: %s", e)
         if error_type == 0:
             if "501" in str(e):
                 error_type = 1
             elif "550" in str(e):
                 error_type = 2
     except Exception as e:
-        logging.error(f"Error general: {str(e)}")
+        logger.error("Error general: %s", e)
         error_type = 3  # Nuevo tipo para errores genéricos
 
     return email_sent, error_type
 
+# Mensajes de error por tipo de error
+ERROR_MESSAGES = {
+    0: "Error desconocido del servidor",
+    1: "Invalid sender address",
+    2: "Invalid recipient address",
+    3: "Error de protocolo SMTP"
+}
+ERROR_OUTPUTS = build_error_outputs(ERROR_MESSAGES)
+
+
 def main():
-    
-    error_messages = {
-        0: "Error desconocido del servidor",
-        1: "Invalid sender address",
-        2: "Invalid recipient address",
-        3: "Error de protocolo SMTP"
-    }
-
-    status_codes = {
-        0: 550,  # Error genérico
-        1: 501,
-        2: 550,
-        3: 503
-    }
+    import argparse
 
     """Función principal para ejecución desde línea de comandos"""
     parser = argparse.ArgumentParser(
@@ -197,23 +287,24 @@ def main():
 
     args = parser.parse_args()
 
+    # Configuración de logging: DEBUG solo si SMTP_DEBUG=1
+    logging.basicConfig(
+        level=logging.DEBUG if os.environ.get("SMTP_DEBUG") == "1" else logging.WARNING,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
     # Procesamiento de encabezados personalizados
     try:
-        if args.header:
-            custom_headers = json.loads(" ".join(args.header))
-            # Validar que los encabezados sean ASCII
-            for key, value in custom_headers.items():
-                if not all(ord(c) < 128 for c in f"{key}: {value}"):
-                    raise ValueError("Encabezados contienen caracteres no ASCII")
+        custom_headers = parse_custom_headers(args.header)
     except Exception as e:
-        print(json.dumps({"status_code": 400, "message": f"Error en encabezados: {str(e)}"}))
+        write_output({"status_code": 400, "message": f"Error en encabezados: {str(e)}"})
         exit(1)
 
     # Procesamiento de destinatarios (se espera un JSON array)
     try:
-        recipients = json.loads(" ".join(args.to_mail))
+        recipients = json_loads(" ".join(args.to_mail))
     except Exception as e:
-        print(json.dumps({"status_code": 400, "message": f"Error en destinatarios: {str(e)}"}))
+        write_output({"status_code": 400, "message": f"Error en destinatarios: {str(e)}"})
         exit(1)
 
     # Construcción de componentes del correo
@@ -221,33 +312,34 @@ def main():
     email_body = " ".join(args.body) if args.body else " "
 
     try:
-        # Ejecutar el cliente SMTP
-        result, error_type = asyncio.run(
-            send_email(
-                args.from_mail,
-                args.password,
-                recipients,
-                email_subject,
-                email_body,
-                custom_headers,
-                args.host,
-                args.port
+        # Ejecutar el cliente SMTP en un bucle de eventos propio
+        loop = new_event_loop()
+        try:
+            result, error_type = loop.run_until_complete(
+                send_email(
+                    args.from_mail,
+                    args.password,
+                    recipients,
+                    email_subject,
+                    email_body,
+                    custom_headers,
+                    args.host,
+                    args.port
+                )
             )
-        )
+        finally:
+            loop.close()
 
         # Generar respuesta basada en resultados
         if result:
-            output = {"status_code": 250, "message": "Message accepted for delivery"}
+            output = SUCCESS_OUTPUT
         else:
-            output = {
-                "status_code": status_codes.get(error_type, 550),
-                "message": error_messages.get(error_type, "Unknown error")
-            }
+            output = ERROR_OUTPUTS.get(error_type, UNKNOWN_ERROR_OUTPUT)
             
     except Exception as e:
         output = {"status_code": 500, "message": f"Excepción: {e}"}
 
-    print(json.dumps(output))
+    write_output(output)
 
 
 if __name__ == "__main__":